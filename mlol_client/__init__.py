@@ -1,2 +1,3 @@
 from .mlol_client import MLOLClient
 from .mlol_types import MLOLBook, MLOLLoan, MLOLReservation, MLOLUser
+from .mlol_async_client import AsyncMLOLClient
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import random
+from collections import deque
+from itertools import islice
+from typing import AsyncGenerator, List, Optional
+
+import httpx
+from selectolax.lexbor import LexborHTMLParser
+
+from .mlol_client import MLOLClient, _SCHEME_RE
+from .mlol_constants import WEB_ENDPOINTS, DEFAULT_WEB_HEADERS
+from .mlol_types import MLOLBook
+
+
+async def _assert_status_hook(response: httpx.Response):
+    # hooks also run on every redirect hop, which must go through
+    if response.is_error:
+        response.raise_for_status()
+
+
+def _get_retry_after(response: httpx.Response) -> Optional[float]:
+    try:
+        return max(0.0, float(response.headers["Retry-After"]))
+    except (KeyError, ValueError):
+        # missing, or an HTTP date: fall back to the backoff
+        return None
+
+
+class AsyncMLOLClient:
+    max_connections = 50
+    max_keepalive_connections = 20
+    prefetch_pages = 2
+    # same retry policy as MLOLClient, which httpx has no equivalent for
+    max_retries = 5
+    backoff_factor = 0.5
+    backoff_jitter = 1.0
+    retry_statuses = frozenset([429, 500, 502, 503, 504])
+    session = None
+
+    def __init__(self, *, domain=None):
+        base_url = (
+            "https://" + _SCHEME_RE.sub("", domain.rstrip("/"))
+            if domain
+            else "https://medialibrary.it"
+        )
+        self.session = httpx.AsyncClient(
+            base_url=base_url,
+            headers=DEFAULT_WEB_HEADERS,
+            # a deep search queues more book requests than there are
+            # connections: let them wait for a free one instead of timing out
+            timeout=httpx.Timeout(10.0, pool=None),
+            transport=httpx.AsyncHTTPTransport(
+                retries=3,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                ),
+            ),
+            follow_redirects=True,
+            event_hooks={"response": [_assert_status_hook]},
+        )
+
+    def __repr__(self):
+        values = {k: v for k, v in self.__dict__.items()}
+        return f"<mlol_client.AsyncMLOLClient: {values}>"
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        await self.session.aclose()
+
+    async def _get(self, url: str, **kwargs) -> httpx.Response:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self.session.get(url, **kwargs)
+            except httpx.HTTPStatusError as e:
+                if (
+                    attempt == self.max_retries
+                    or e.response.status_code not in self.retry_statuses
+                ):
+                    raise
+                delay = _get_retry_after(e.response)
+                if delay is None:
+                    # jittered, so that a deep search's lookups don't all
+                    # hit the server again at the same moment
+                    delay = self.backoff_factor * 2**attempt + random.uniform(
+                        0, self.backoff_jitter
+                    )
+            logging.debug(f"Retrying {url} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def _search_books_paginated(
+        self,
+        *,
+        req_params: dict,
+        pages: int,
+        deep: bool = False,
+        first_page: LexborHTMLParser = None,
+    ) -> AsyncGenerator[List[MLOLBook], None]:
+        # keep the next pages downloading while the current one is consumed
+        page_numbers = iter(range(2 if first_page else 1, pages + 1))
+        in_flight = deque(
+            self._fetch_search_page(req_params, i)
+            for i in islice(page_numbers, self.prefetch_pages)
+        )
+        try:
+            if first_page:
+                yield await self._get_search_page_books(first_page, deep=deep)
+            while in_flight:
+                response = await in_flight.popleft()
+                if (i := next(page_numbers, None)) is not None:
+                    in_flight.append(self._fetch_search_page(req_params, i))
+                yield await self._get_search_page_books(
+                    LexborHTMLParser(response.text), deep=deep
+                )
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+    def _fetch_search_page(self, req_params: dict, page: int) -> asyncio.Future:
+        return asyncio.ensure_future(
+            self._get(WEB_ENDPOINTS["search"], params={**req_params, **{"page": page}})
+        )
+
+    async def _get_search_page_books(
+        self, page: LexborHTMLParser, *, deep: bool = False
+    ) -> List[MLOLBook]:
+        books = MLOLClient._parse_search_page(page)
+        if deep:
+            tasks = [asyncio.ensure_future(self.get_book_by_id(b.id)) for b in books]
+            try:
+                return list(await asyncio.gather(*tasks))
+            except BaseException:
+                # gather leaves the other lookups running when one fails
+                for task in tasks:
+                    task.cancel()
+                raise
+
+        return books
+
+    async def get_book_by_id(self, book_id: str) -> Optional[MLOLBook]:
+        logging.debug(f"Fetching book {book_id}")
+        response = await self._get(WEB_ENDPOINTS["get_book"], params={"id": book_id})
+        if "alert.aspx" in str(response.url):
+            logging.warning(
+                f"Failed to fetch book {book_id}. Might not be available to your library."
+            )
+            return None
+
+        return MLOLClient._parse_book(str(book_id), response.text)
+
+    async def get_book(self, book: MLOLBook) -> Optional[MLOLBook]:
+        if not isinstance(book, MLOLBook):
+            raise ValueError(f"Expected MLOLBook, got {type(book)}")
+
+        return await self.get_book_by_id(book.id)
+
+    def get_book_url_by_id(self, book_id: str) -> str:
+        return f"{self.session.base_url.join(WEB_ENDPOINTS['get_book'])}?id={book_id}"
+
+    def get_book_url(self, book: MLOLBook) -> str:
+        return self.get_book_url_by_id(book.id)
+
+    async def search_books(
+        self, query: str, *, deep: bool = False
+    ) -> AsyncGenerator[List[MLOLBook], None]:
+        params = {"seltip": 310, "keywords": query.strip(), "nris": 48}
+        response = await self._get(WEB_ENDPOINTS["search"], params=params)
+        first_page = LexborHTMLParser(response.text)
+
+        async for page in self._search_books_paginated(
+            req_params=params,
+            deep=deep,
+            pages=MLOLClient._parse_page_count(first_page),
+            first_page=first_page,
+        ):
+            yield page
+
+    async def get_latest_books(
+        self, *, deep: bool = False
+    ) -> AsyncGenerator[List[MLOLBook], None]:
+        params = {"seltip": 310, "news": "15day", "nris": 48}
+        response = await self._get(WEB_ENDPOINTS["search"], params=params)
+        first_page = LexborHTMLParser(response.text)
+
+        async for page in self._search_books_paginated(
+            req_params=params,
+            deep=deep,
+            pages=MLOLClient._parse_page_count(first_page),
+            first_page=first_page,
+        ):
+            yield page
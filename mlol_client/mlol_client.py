@@ -2,20 +2,28 @@ import json
 import logging
 import os
 import re
+import threading
 import time
 from base64 import b64decode
-from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
+from http.cookiejar import DefaultCookiePolicy
+from itertools import islice
 from shutil import copy
-from typing import Optional, List, Generator
+from typing import BinaryIO, Optional, List, Generator, Union
 
+import lxml.html
 import requests
 from bs4 import BeautifulSoup, Tag
+from lxml import etree
 from requests.adapters import HTTPAdapter
 from requests.models import Response
-from requests.packages.urllib3.util.retry import Retry
+from requests_cache import CacheMixin
 from requests_toolbelt import sessions
+from selectolax.lexbor import LexborHTMLParser
+from urllib3.util.retry import Retry
 
 from .mlol_constants import (
     WEB_ENDPOINTS,
@@ -23,9 +31,52 @@ from .mlol_constants import (
     DEFAULT_API_HEADERS,
     DEFAULT_WEB_HEADERS,
     LIBRARY_MAPPING_FNAME,
+    HTTP_CACHE_NAME,
+    HTTP_CACHE_EXPIRE_AFTER,
 )
 from .mlol_types import MLOLBook, MLOLLoan, MLOLReservation, MLOLUser
 
+_SCHEME_RE = re.compile(r"https?(://)")
+_ID_RE = re.compile(r"(?<=id=)\d+$")
+_HREF_ID_RE = re.compile(r"(?<=\=)\d+$")
+_QUEUE_POSITION_RE = re.compile(r"\d+(?=°)")
+_FORMATO_RE = re.compile("FORMATO")
+_CANCEL_RESERVATION_HREF_RE = re.compile(r"(?<=annullaPr.aspx\?id=)\d+$")
+_BOOK_HREF_RE = re.compile(r"(?<=scheda.aspx\?id=)\d+$")
+
+_FULFILLMENT_TOKEN_PREFIX = b"<fulfillmentToken"
+_DOWNLOAD_CHUNK_SIZE = 65536
+
+
+def _parse_html(html: str) -> BeautifulSoup:
+    return BeautifulSoup(html, "lxml")
+
+
+def _set_encoding_hook(response: Response, *args, **kwargs):
+    # medialibrary.it pages are UTF-8: setting it upfront spares requests from
+    # running charset detection on the whole body when response.text is read
+    response.encoding = "utf-8"
+
+
+def _strip_cookies_hook(response: Response, *args, **kwargs):
+    # the cached session has no use for cookies, and they must not be stored
+    response.headers.pop("Set-Cookie", None)
+    response.raw.headers.discard("Set-Cookie")
+    response.cookies.clear()
+
+
+def _is_cookie_free(response: Response) -> bool:
+    # last line of defence: never write anything tied to a login to disk
+    return (
+        "Cookie" not in response.request.headers
+        and "Set-Cookie" not in response.headers
+        and not response.cookies
+    )
+
+
+class _CachedBaseUrlSession(CacheMixin, sessions.BaseUrlSession):
+    pass
+
 
 class MLOLApiConverter:
     @staticmethod
@@ -94,15 +145,35 @@ class MLOLApiConverter:
 
 class MLOLClient:
     max_threads = 5
+    prefetch_pages = 2
+    book_cache_size = 1024
+    book_cache_expire_after = HTTP_CACHE_EXPIRE_AFTER
     library_id = None
     session = None
     api_token = None
 
     def __init__(self, *, domain=None, username=None, password=None, library_id=None):
-        self.session = sessions.BaseUrlSession(base_url="https://medialibrary.it")
+        self._pool = ThreadPoolExecutor(max_workers=self.max_threads)
+        # book pages are cached per client, as their status depends on the user
+        self._book_cache = OrderedDict()
+        self._book_cache_lock = threading.Lock()
+        authenticated = bool(username and password and domain)
+        self._authenticated = authenticated
+        self._cached_session = None
+        self._cached_session_lock = threading.Lock()
+        self.session = sessions.BaseUrlSession(
+            base_url="https://" + _SCHEME_RE.sub("", domain.rstrip("/"))
+            if authenticated
+            else "https://medialibrary.it"
+        )
         self.session.headers.update(DEFAULT_WEB_HEADERS)
+        self.session.headers["Connection"] = "keep-alive"
+        self.session.headers["Accept-Charset"] = "utf-8"
+        # per-request headers are merged into the session ones by requests
+        self._host = _SCHEME_RE.sub("", self.session.base_url)
+        self._web_headers = {"Host": self._host}
 
-        if not (username and password and domain):
+        if not authenticated:
             logging.warning(
                 "You did not provide authentication credentials and a subdomain. You will not be able to perform actions that require authentication."
             )
@@ -112,49 +183,91 @@ class MLOLClient:
             if saved_library_id := self._get_saved_library_id():
                 self.library_id = saved_library_id
 
-            self.session.base_url = "https://" + re.sub(
-                r"https?(://)", "", domain.rstrip("/")
-            )
-
             self._authenticate(
                 username=username,
                 password=password,
                 library_id=library_id if library_id else saved_library_id,
             )
 
+        # size the pool so that concurrent page and book fetches can all keep
+        # their connection alive instead of reconnecting
         adapter = HTTPAdapter(
+            pool_connections=self.max_threads * 2,
+            pool_maxsize=self.max_threads * 4,
+            pool_block=False,
+            # jittered backoff and Retry-After keep concurrent retries from
+            # hammering the server in lockstep; 404s are not worth retrying
             max_retries=Retry(
-                total=3,
-                backoff_factor=1,
-                status_forcelist=[404, 429, 500, 502, 503, 504],
-                method_whitelist=["HEAD", "GET", "OPTIONS"],
-            )
+                total=5,
+                backoff_factor=0.5,
+                backoff_jitter=1.0,
+                respect_retry_after_header=True,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=frozenset(["HEAD", "GET", "OPTIONS"]),
+            ),
         )
         self.session.mount("https://", adapter)
         self.session.mount("http://", adapter)
         assert_status_hook = (
             lambda response, *args, **kwargs: response.raise_for_status()
         )
-        self.session.hooks["response"] = [assert_status_hook]
+        self.session.hooks["response"] = [_set_encoding_hook, assert_status_hook]
 
     def __repr__(self):
         values = {k: v for k, v in self.__dict__.items()}
         values["password"] = "***"
         return f"<mlol_client.MLOLClient: {values}"
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        # don't wait for, or keep running, prefetches nobody will consume
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        if self._cached_session:
+            self._cached_session.close()
+        self.session.close()
+
+    def _get_cached_session(self) -> _CachedBaseUrlSession:
+        # only used for pages that don't depend on who is logged in, so it
+        # never sends or stores cookies. Created on first use, so clients
+        # that never search don't open the cache at all.
+        with self._cached_session_lock:
+            if self._cached_session is None:
+                session = _CachedBaseUrlSession(
+                    base_url=self.session.base_url,
+                    cache_name=HTTP_CACHE_NAME,
+                    backend="sqlite",
+                    use_cache_dir=True,
+                    expire_after=HTTP_CACHE_EXPIRE_AFTER,
+                    allowable_methods=["GET"],
+                    filter_fn=_is_cookie_free,
+                )
+                # share headers and connections with the main session, but
+                # keep its own cookie jar, which refuses every cookie
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                session.headers = self.session.headers
+                session.hooks["response"] = [
+                    _strip_cookies_hook,
+                    *self.session.hooks["response"],
+                ]
+                session.adapters = self.session.adapters
+                self._cached_session = session
+
+            return self._cached_session
+
     def _login_web(self, *, username: str, password: str, library_id: str):
         headers = {
-            **self.session.headers,
-            **{
-                "Host": self.domain.replace("https://", ""),
-                "Origin": self.domain,
-                "Referer": f"{self.session.base_url}/user/logform.aspx",
-            },
+            **self._web_headers,
+            "Origin": self.domain,
+            "Referer": f"{self.session.base_url}/user/logform.aspx",
         }
         data = {"lusername": username, "lpassword": password, "lente": library_id}
-        response = self.session.request(
-            "POST",
-            url=WEB_ENDPOINTS["login"],
+        response = self.session.post(
+            WEB_ENDPOINTS["login"],
             headers=headers,
             data=data,
             allow_redirects=False,
@@ -214,8 +327,8 @@ class MLOLClient:
     ) -> Optional[bool]:
 
         if not library_id:
-            response = self.session.request("GET", url=WEB_ENDPOINTS["index"])
-            soup = BeautifulSoup(response.text, "html.parser")
+            response = self.session.get(WEB_ENDPOINTS["index"])
+            soup = _parse_html(response.text)
             # get all "lente" values for subdomain, try all
             if library_id_els := soup.select("#lente > option"):
                 library_id_values = [
@@ -293,12 +406,10 @@ class MLOLClient:
 
     def _get_queue_position(self, reservation_id: str) -> Optional[int]:
         params = {"id": reservation_id}
-        response = self.session.request(
-            "GET", url=WEB_ENDPOINTS["get_queue_position"], params=params
-        )
+        response = self.session.get(WEB_ENDPOINTS["get_queue_position"], params=params)
 
         if "in coda" in response.text and (
-            queue_position := re.search(r"\d+(?=°)", response.text)
+            queue_position := _QUEUE_POSITION_RE.search(response.text)
         ):
             return int(queue_position.group())
 
@@ -306,26 +417,26 @@ class MLOLClient:
         return
 
     @staticmethod
-    def _parse_search_page(page: Tag) -> List[MLOLBook]:
+    def _parse_search_page(page: LexborHTMLParser) -> List[MLOLBook]:
+        # search pages are parsed with selectolax: we only need a few
+        # attributes per result, so a full bs4 tree is not worth building
         books = []
-        for i, book in enumerate(page.select(".result-item")):
+        for i, book in enumerate(page.css(".result-item")):
             try:
-                ID_RE = r"(?<=id=)\d+$"
-                title = book.find("h4").attrs["title"]
-                url = book.find("a").attrs["href"]
-                id = re.search(ID_RE, url).group()
+                title = book.css_first("h4").attributes["title"]
+                url = book.css_first("a").attributes["href"]
+                id = _ID_RE.search(url).group()
             except:
                 logging.error(f"Could not parse ID or title. Skipping book #{i+1}...")
                 continue
 
             try:
-                author_el = book.select("p > a.authorref")
-                if len(author_el) > 0:
-                    authors = author_el[0].string.strip()
-                elif author_el := book.find("p", attrs={"itemprop": "author"}):
-                    authors = author_el.string.strip()
-                elif author_el := book.select_one(".product-author"):
-                    authors = author_el.string.strip()
+                if author_el := book.css_first("p > a.authorref"):
+                    authors = author_el.text().strip()
+                elif author_el := book.css_first('p[itemprop="author"]'):
+                    authors = author_el.text().strip()
+                elif author_el := book.css_first(".product-author"):
+                    authors = author_el.text().strip()
                 else:
                     logging.warning(f"Failed to parse author for book {title}")
                     authors = None
@@ -346,6 +457,13 @@ class MLOLClient:
 
         return books
 
+    @staticmethod
+    def _parse_page_count(page: LexborHTMLParser) -> int:
+        try:
+            return int(page.css_first("#pager").attributes["data-pages"])
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return 1
+
     @staticmethod
     def _parse_book_status(status: str) -> Optional[str]:
         status = status.strip().lower()
@@ -362,77 +480,138 @@ class MLOLClient:
         return None
 
     @staticmethod
-    def _parse_book_page(page: Tag) -> dict:
-        book_data = defaultdict(lambda: None)
+    def _parse_book_page(html: str) -> dict:
+        book_data = {}
+        formats_el = None
 
-        if title := page.select_one(".book-title"):
-            book_data["title"] = title.text.strip()
-
-        if authors := page.select_one(".authors_title"):
-            book_data["authors"] = [a.strip() for a in authors.text.strip().split(";")]
-
-        if publisher := page.select_one(".publisher_title > span > a"):
-            book_data["publisher"] = publisher.text.strip()
+        try:
+            root = lxml.html.fromstring(html)
+        except (etree.ParserError, ValueError):
+            # empty body, or an XML declaration lxml refuses in a str
+            logging.warning("Failed to parse book page")
+            return book_data
+
+        # single walk over the tree: each field takes the first matching element
+        for el in root.iter(etree.Element):
+            classes = el.get("class", "").split()
+            itemprop = el.get("itemprop")
+
+            if "title" not in book_data and "book-title" in classes:
+                book_data["title"] = el.text_content().strip()
+
+            if "authors" not in book_data and "authors_title" in classes:
+                book_data["authors"] = [
+                    a.strip() for a in el.text_content().strip().split(";")
+                ]
 
-        if ISBNs := page.find_all(attrs={"itemprop": "isbn"}):
-            book_data["ISBNs"] = [i.text.strip() for i in ISBNs]
+            if (
+                "publisher" not in book_data
+                and el.tag == "a"
+                and (parent := el.getparent()) is not None
+                and parent.tag == "span"
+                and (grandparent := parent.getparent()) is not None
+                and "publisher_title" in grandparent.get("class", "").split()
+            ):
+                book_data["publisher"] = el.text_content().strip()
 
-        if status_element := page.select_one(".panel-mlol"):
-            book_data["status"] = MLOLClient._parse_book_status(
-                status_element.text.strip()
-            )
+            if itemprop == "isbn":
+                book_data.setdefault("ISBNs", []).append(el.text_content().strip())
 
-        if (description_el := page.find("div", attrs={"itemprop": "description"})) and (
-            description := next(
-                filter(
-                    lambda x: hasattr(x, "text"),
-                    description_el,
+            if "status" not in book_data and "panel-mlol" in classes:
+                book_data["status"] = MLOLClient._parse_book_status(
+                    el.text_content().strip()
                 )
-            )
-        ):
-            book_data["description"] = description.text.strip()
 
-        if language := page.find("span", attrs={"itemprop": "inLanguage"}):
-            book_data["language"] = language.text.strip()
+            if (
+                "description" not in book_data
+                and el.tag == "div"
+                and itemprop == "description"
+            ):
+                # only the first child, as the rest is not part of the description
+                if el.text:
+                    book_data["description"] = el.text.strip()
+                elif len(el):
+                    book_data["description"] = el[0].text_content().strip()
+
+            if (
+                "language" not in book_data
+                and el.tag == "span"
+                and itemprop == "inLanguage"
+            ):
+                book_data["language"] = el.text_content().strip()
 
-        if year := page.find("span", attrs={"itemprop": "datePublished"}):
-            book_data["year"] = int(year.text.strip())
+            if (
+                "year" not in book_data
+                and el.tag == "span"
+                and itemprop == "datePublished"
+            ):
+                book_data["year"] = int(el.text_content().strip())
+
+            if (
+                formats_el is None
+                and el.tag == "b"
+                and _FORMATO_RE.search(el.text_content())
+            ):
+                formats_el = el
 
         try:
             # e.g. "EPUB/PDF con DRM Adobe"
             formats_str = (
-                page.find("b", text=re.compile("FORMATO"))
-                .parent.parent.find("span")
-                .text.strip()
+                formats_el.getparent()
+                .getparent()
+                .find(".//span")
+                .text_content()
+                .strip()
             )
             book_data["drm"] = "drm" in formats_str.lower()
             book_data["formats"] = [
                 f.strip().lower() for f in formats_str.split()[0].split("/")
             ]
         except:
-            logging.warning(f"Failed to parse formats for book {book_data['title']}")
+            logging.warning(
+                f"Failed to parse formats for book {book_data.get('title')}"
+            )
 
         return book_data
 
+    @staticmethod
+    def _parse_book(book_id: str, html: str) -> Optional[MLOLBook]:
+        book_data = MLOLClient._parse_book_page(html)
+        if book_data.get("title") is None:
+            logging.warning(f"Failed to get book title for id {book_id}, skipping...")
+            return None
+
+        return MLOLBook(
+            id=book_id,
+            title=book_data.get("title"),
+            authors=book_data.get("authors"),
+            publisher=book_data.get("publisher"),
+            ISBNs=book_data.get("ISBNs"),
+            status=book_data.get("status"),
+            language=book_data.get("language"),
+            description=book_data.get("description"),
+            year=book_data.get("year"),
+            formats=book_data.get("formats"),
+            drm=book_data.get("drm"),
+        )
+
     @staticmethod
     def _parse_reservation(
         reservation_el: Tag, *, index: int = -1
     ) -> Optional[MLOLReservation]:
         reservation_id = book_id = None
         if reservation_id_element := reservation_el.find(
-            "a", attrs={"href": re.compile(r"(?<=annullaPr.aspx\?id=)\d+$")}
+            "a", attrs={"href": _CANCEL_RESERVATION_HREF_RE}
         ):
-            reservation_id = re.search(
-                r"(?<=\=)\d+$", reservation_id_element.attrs["href"]
+            reservation_id = _HREF_ID_RE.search(
+                reservation_id_element.attrs["href"]
             ).group()
         else:
             logging.error(f"Could not find loan ID for reservation #{index + 1}")
             return
 
-        if book_id_element := reservation_el.find(
-            "a", attrs={"href": re.compile(r"(?<=scheda.aspx\?id=)\d+$")}
-        ):
-            book_id = re.search(r"(?<=\=)\d+$", book_id_element.attrs["href"]).group()
+        if book_id_element := reservation_el.find("a", attrs={"href": _BOOK_HREF_RE}):
+            book_id = _HREF_ID_RE.search(book_id_element.attrs["href"]).group()
         else:
             logging.error(f"Could not find book ID for reservation #{index + 1}")
             return
@@ -467,18 +646,15 @@ class MLOLClient:
     def _redownload_owned_book(self, book_id: str) -> Response:
         active_loans = self.get_resources()["active_loans"]
         if loan_id := next((l.id for l in active_loans if l.book_id == book_id), None):
-            response = self.session.request(
-                "GET",
-                url=WEB_ENDPOINTS["redownload"],
+            response = self.session.get(
+                WEB_ENDPOINTS["redownload"],
                 headers={
-                    **self.session.headers,
-                    **{
-                        "Host": self.session.base_url.replace("https://", ""),
-                        "Referer": f"{self.session.base_url}/help/helpdeskdl.aspx?idp={loan_id}",
-                    },
+                    **self._web_headers,
+                    "Referer": f"{self.session.base_url}/help/helpdeskdl.aspx?idp={loan_id}",
                 },
                 params={"idp": loan_id},
                 allow_redirects=False,
+                stream=True,
             )
             return response
 
@@ -491,31 +667,48 @@ class MLOLClient:
         req_params: dict,
         pages: int,
         deep: bool = False,
-        first_response: Response = None,
+        first_page: LexborHTMLParser = None,
     ) -> Generator[List[MLOLBook], None, None]:
-        for i in range(1, pages + 1):
-            response = (
-                first_response
-                if pages == 1
-                else self.session.request(
-                    method="GET",
-                    url=WEB_ENDPOINTS["search"],
-                    params={**req_params, **{"page": i}},
+        # keep the next pages downloading while the current one is consumed
+        page_numbers = iter(range(2 if first_page else 1, pages + 1))
+        in_flight = deque(
+            self._fetch_search_page(req_params, i)
+            for i in islice(page_numbers, self.prefetch_pages)
+        )
+        try:
+            if first_page:
+                yield self._get_search_page_books(first_page, deep=deep)
+            while in_flight:
+                response = in_flight.popleft().result()
+                if (i := next(page_numbers, None)) is not None:
+                    in_flight.append(self._fetch_search_page(req_params, i))
+                yield self._get_search_page_books(
+                    LexborHTMLParser(response.text), deep=deep
                 )
-            )
-            books = self._parse_search_page(BeautifulSoup(response.text, "html.parser"))
-            if deep:
-                with ThreadPoolExecutor(
-                    max_workers=min(len(books), self.max_threads)
-                ) as executor:
-                    yield list(executor.map(self.get_book_by_id, (b.id for b in books)))
-            else:
-                yield books
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+    def _fetch_search_page(self, req_params: dict, page: int) -> Future:
+        return self._pool.submit(
+            self._get_cached_session().get,
+            WEB_ENDPOINTS["search"],
+            params={**req_params, **{"page": page}},
+        )
+
+    def _get_search_page_books(
+        self, page: LexborHTMLParser, *, deep: bool = False
+    ) -> List[MLOLBook]:
+        books = self._parse_search_page(page)
+        if deep:
+            return list(self._pool.map(self.get_book_by_id, (b.id for b in books)))
+
+        return books
 
     def _get_reservations(self) -> List[MLOLReservation]:
         reservations = []
-        response = self.session.request("GET", WEB_ENDPOINTS["resources"])
-        soup = BeautifulSoup(response.text, "html.parser")
+        response = self.session.get(WEB_ENDPOINTS["resources"])
+        soup = _parse_html(response.text)
 
         if reservations_el := soup.select_one("#mlolreservation"):
             for i, reservation_el in enumerate(
@@ -527,11 +720,13 @@ class MLOLClient:
 
         return [r for r in reservations if r is not None]
 
-    def get_book_by_id(self, book_id: str) -> Optional[MLOLBook]:
+    def _fetch_book(self, book_id: str) -> Optional[MLOLBook]:
         logging.debug(f"Fetching book {book_id}")
-        response = self.session.request(
-            "GET",
-            url=WEB_ENDPOINTS["get_book"],
+        # book pages show the user's loan/reservation status, so they are only
+        # cached for anonymous clients
+        session = self.session if self._authenticated else self._get_cached_session()
+        response = session.get(
+            WEB_ENDPOINTS["get_book"],
             params={"id": book_id},
         )
         if "alert.aspx" in response.url:
@@ -539,25 +734,44 @@ class MLOLClient:
                 f"Failed to fetch book {book_id}. Might not be available to your library."
             )
             return None
-        soup = BeautifulSoup(response.text, "html.parser")
-        book_data = self._parse_book_page(soup)
-        if book_data["title"] is None:
-            logging.warning(f"Failed to get book title for id {book_id}, skipping...")
-            return None
 
-        return MLOLBook(
-            id=book_id,
-            title=book_data["title"],
-            authors=book_data["authors"],
-            publisher=book_data["publisher"],
-            ISBNs=book_data["ISBNs"],
-            status=book_data["status"],
-            language=book_data["language"],
-            description=book_data["description"],
-            year=book_data["year"],
-            formats=book_data["formats"],
-            drm=book_data["drm"],
-        )
+        return self._parse_book(book_id, response.text)
+
+    def get_book_by_id(
+        self, book_id: str, *, refresh: bool = False
+    ) -> Optional[MLOLBook]:
+        book_id = str(book_id)
+        book = None
+        with self._book_cache_lock:
+            if not refresh and (entry := self._book_cache.get(book_id)):
+                fetched_at, book = entry
+                if time.monotonic() - fetched_at > self.book_cache_expire_after:
+                    del self._book_cache[book_id]
+                    book = None
+                else:
+                    self._book_cache.move_to_end(book_id)
+
+        if not book:
+            # failures are not cached, so that they can be retried
+            if not (book := self._fetch_book(book_id)):
+                return None
+
+            with self._book_cache_lock:
+                self._book_cache[book_id] = (time.monotonic(), book)
+                self._book_cache.move_to_end(book_id)
+                if len(self._book_cache) > self.book_cache_size:
+                    self._book_cache.popitem(last=False)
+
+        # callers get their own copy, so that they can't change the cached one
+        return deepcopy(book)
+
+    def clear_book_cache(self):
+        with self._book_cache_lock:
+            self._book_cache.clear()
+
+    def _forget_book(self, book_id: str):
+        with self._book_cache_lock:
+            self._book_cache.pop(str(book_id), None)
 
     def get_book(self, book: MLOLBook) -> Optional[MLOLBook]:
         if not isinstance(book, MLOLBook):
@@ -565,55 +779,77 @@ class MLOLClient:
 
         return self.get_book_by_id(book.id)
 
-    def download_book_by_id(self, book_id: str) -> Optional[bytes]:
+    def download_book_by_id(
+        self, book_id: str, *, fp: BinaryIO = None, _status: str = None
+    ) -> Union[bytes, bool, None]:
         if not self.session.cookies.get(".ASPXAUTH"):
             logging.error(
                 "You need to be authenticated to MLOL in order to download books."
             )
             return
 
-        book = self.get_book_by_id(book_id)
-        if book.status == "owned":
+        # skip fetching the book page if the caller already knows the status
+        status = _status if _status else self.get_book_by_id(book_id).status
+        if status == "owned":
             logging.info("You already own this book. Redownloading...")
             response = self._redownload_owned_book(book_id)
-        elif book.status != "available":
-            logging.error(f"Book is not available for download. Status: {book.status}")
+        elif status != "available":
+            logging.error(f"Book is not available for download. Status: {status}")
             return
         else:
-            response = self.session.request(
-                "GET",
-                url=WEB_ENDPOINTS["download"],
+            response = self.session.get(
+                WEB_ENDPOINTS["download"],
                 headers={
-                    **self.session.headers,
-                    **{
-                        "Host": self.session.base_url.replace("https://", ""),
-                        "Referer": f"{self.session.base_url}/media/downloadebad2.aspx?unid={book_id}&form=epub",
-                    },
+                    **self._web_headers,
+                    "Referer": f"{self.session.base_url}/media/downloadebad2.aspx?unid={book_id}&form=epub",
                 },
                 params={"unid": book_id, "form": "epub"},
                 allow_redirects=False,
+                stream=True,
             )
+        # the book is now owned, its cached status is stale
+        self._forget_book(book_id)
 
         if response.status_code == 302:
-            response = self.session.request(
-                "GET",
-                url=response.headers["Location"],
-                headers={**self.session.headers, **{"Sec-Fetch-Site": "cross-site"}},
+            response.close()
+            response = self.session.get(
+                response.headers["Location"],
+                headers={"Sec-Fetch-Site": "cross-site"},
+                stream=True,
             )
 
-        if response.text.startswith("<fulfillmentToken"):
+        with response:
+            # only read as much as needed to check the format before
+            # writing or collecting the rest of the body
+            chunks = response.iter_content(chunk_size=_DOWNLOAD_CHUNK_SIZE)
+            head = b""
+            while len(head) < len(_FULFILLMENT_TOKEN_PREFIX) and (
+                chunk := next(chunks, None)
+            ):
+                head += chunk
+
+            if not head.startswith(_FULFILLMENT_TOKEN_PREFIX):
+                logging.error(f"Failed to download book {book_id}")
+                # the start of the page is enough to tell what went wrong
+                logging.debug(head[:512].decode(errors="replace"))
+                return None
+
             logging.info(f"Book {book_id} downloaded")
-            return response.content
-        else:
-            logging.error(f"Failed to download book {book_id}")
-            logging.debug(response.text)
-            return None
+            if fp is None:
+                return b"".join([head, *chunks])
 
-    def download_book(self, book: MLOLBook) -> Optional[bytes]:
+            fp.write(head)
+            for chunk in chunks:
+                fp.write(chunk)
+            return True
+
+    def download_book(
+        self, book: MLOLBook, *, fp: BinaryIO = None
+    ) -> Union[bytes, bool, None]:
         if not isinstance(book, MLOLBook):
             raise ValueError(f"Expected MLOLBook, got {type(book)}")
 
-        return self.download_book_by_id(book.id)
+        return self.download_book_by_id(book.id, fp=fp, _status=book.status)
 
     def get_book_url_by_id(self, book_id: str) -> str:
         return f"{self.session.base_url}{WEB_ENDPOINTS['get_book']}?id={book_id}"
@@ -621,35 +857,32 @@ class MLOLClient:
     def get_book_url(self, book: MLOLBook) -> str:
         return self.get_book_url_by_id(book.id)
 
-    def reserve_book_by_id(self, book_id: str, *, email: str) -> Optional[bool]:
+    def reserve_book_by_id(
+        self, book_id: str, *, email: str, _status: str = None
+    ) -> Optional[bool]:
         if not self.session.cookies.get(".ASPXAUTH"):
             logging.error(
                 "You need to be authenticated to MLOL in order to download books."
             )
             return
 
-        book = self.get_book_by_id(book_id)
-        if book.status != "taken":
-            logging.error(
-                f"You can only reserve taken books. Book status: {book.status}"
-            )
+        status = _status if _status else self.get_book_by_id(book_id).status
+        if status != "taken":
+            logging.error(f"You can only reserve taken books. Book status: {status}")
 
         headers = {
-            **self.session.headers,
-            **{
-                "Host": self.session.base_url.replace("https://", ""),
-                "Referer": f"{self.session.base_url}{WEB_ENDPOINTS['pre_reserve']}?id={book_id}",
-                "Accept": "text/html, */*; q=0.01",
-            },
+            **self._web_headers,
+            "Referer": f"{self.session.base_url}{WEB_ENDPOINTS['pre_reserve']}?id={book_id}",
+            "Accept": "text/html, */*; q=0.01",
         }
 
-        response = self.session.request(
-            "GET",
+        response = self.session.get(
             # don't pass params, build the URL directly to avoid percent encoding
-            url=f"{WEB_ENDPOINTS['reserve']}?id={book_id}&email={email}",
+            f"{WEB_ENDPOINTS['reserve']}?id={book_id}&email={email}",
             headers=headers,
         )
-        soup = BeautifulSoup(response.text, "html.parser")
+        self._forget_book(book_id)
+        soup = _parse_html(response.text)
         if outcome := soup.select_one("#lblInfo"):
             message = outcome.text.strip().lower()
             if "con successo" in message:
@@ -669,25 +902,23 @@ class MLOLClient:
         if not isinstance(book, MLOLBook):
             raise ValueError(f"Expected MLOLBook, got {type(book)}")
 
-        return self.reserve_book_by_id(book.id, email=email)
+        return self.reserve_book_by_id(book.id, email=email, _status=book.status)
 
     def cancel_reservation_by_id(self, reservation_id: str) -> Optional[bool]:
         params = {"id": reservation_id}
         headers = {
-            **self.session.headers,
-            **{
-                "Host": self.session.base_url.replace("https://", ""),
-                "Referer": f"{self.session.base_url}/user/risorse.aspx",
-                "Accept-Encoding": "gzip, deflate, br",
-            },
+            **self._web_headers,
+            "Referer": f"{self.session.base_url}/user/risorse.aspx",
+            "Accept-Encoding": "gzip, deflate, br",
         }
-        response = self.session.request(
-            "GET",
-            url=WEB_ENDPOINTS["cancel_reservation"],
+        response = self.session.get(
+            WEB_ENDPOINTS["cancel_reservation"],
             headers=headers,
             params=params,
             allow_redirects=False,
         )
+        # the reservation ID doesn't tell which book it was for
+        self.clear_book_cache()
         redirect_url = response.headers["Location"]
 
         if redirect_url.endswith("msg=970"):
@@ -767,36 +998,34 @@ class MLOLClient:
         self, query: str, *, deep: bool = False
     ) -> Generator[List[MLOLBook], None, None]:
         params = {"seltip": 310, "keywords": query.strip(), "nris": 48}
-        response = self.session.request(
-            "GET", url=WEB_ENDPOINTS["search"], params=params
+        response = self._get_cached_session().get(
+            WEB_ENDPOINTS["search"], params=params
         )
-        soup = BeautifulSoup(response.text, "html.parser")
-
-        try:
-            pages = int(soup.select_one("#pager").attrs["data-pages"])
-        except AttributeError:
-            pages = 1
+        # the first page is parsed once, for both the page count and its results
+        page = LexborHTMLParser(response.text)
 
         return self._search_books_paginated(
-            req_params=params, deep=deep, pages=pages, first_response=response
+            req_params=params,
+            deep=deep,
+            pages=self._parse_page_count(page),
+            first_page=page,
         )
 
     def get_latest_books(
         self, *, deep: bool = False
     ) -> Generator[List[MLOLBook], None, None]:
         params = {"seltip": 310, "news": "15day", "nris": 48}
-        response = self.session.request(
-            "GET", url=WEB_ENDPOINTS["search"], params=params
+        response = self._get_cached_session().get(
+            WEB_ENDPOINTS["search"], params=params
         )
-        soup = BeautifulSoup(response.text, "html.parser")
-
-        try:
-            pages = int(soup.select_one("#pager").attrs["data-pages"])
-        except AttributeError:
-            pages = 1
+        # the first page is parsed once, for both the page count and its results
+        page = LexborHTMLParser(response.text)
 
         return self._search_books_paginated(
-            req_params=params, deep=deep, pages=pages, first_response=response
+            req_params=params,
+            deep=deep,
+            pages=self._parse_page_count(page),
+            first_page=page,
         )
 
     def get_user(self) -> Optional[MLOLUser]:
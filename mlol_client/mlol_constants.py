@@ -1,6 +1,10 @@
 import os
 
 LIBRARY_MAPPING_FNAME = os.path.join(os.path.dirname(__file__), "library_mapping.json")
+# stored in the user's cache directory
+HTTP_CACHE_NAME = "mlol_client"
+# seconds
+HTTP_CACHE_EXPIRE_AFTER = 3600
 
 DEFAULT_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.67 Safari/537.36"
 DEFAULT_WEB_HEADERS = {
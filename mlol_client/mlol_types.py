@@ -2,6 +2,12 @@ from datetime import datetime
 from typing import List
 
 
+def _repr_value(value) -> str:
+    # convert only once, descriptions can be long
+    value = str(value)
+    return value[:50] + "..." if len(value) > 50 else value
+
+
 class MLOLBook:
     def __init__(
         self,
@@ -31,11 +37,7 @@ class MLOLBook:
         self.drm = drm
 
     def __repr__(self):
-        values = {
-            k: "{}{}".format(str(v)[:50], "..." if len(str(v)) > 50 else "")
-            for k, v in self.__dict__.items()
-            if v is not None
-        }
+        values = {k: _repr_value(v) for k, v in self.__dict__.items() if v is not None}
         return f"<mlol_client.MLOLBook: {values}>"
 
 
@@ -54,11 +56,7 @@ class MLOLLoan:
         self.end_date = end_date
 
     def __repr__(self):
-        values = {
-            k: "{}{}".format(str(v)[:50], "..." if len(str(v)) > 50 else "")
-            for k, v in self.__dict__.items()
-            if v is not None
-        }
+        values = {k: _repr_value(v) for k, v in self.__dict__.items() if v is not None}
         return f"<mlol_client.MLOLLoan: {values}>"
 
 
@@ -79,11 +77,7 @@ class MLOLReservation:
         self.queue_position = queue_position
 
     def __repr__(self):
-        values = {
-            k: "{}{}".format(str(v)[:50], "..." if len(str(v)) > 50 else "")
-            for k, v in self.__dict__.items()
-            if v is not None
-        }
+        values = {k: _repr_value(v) for k, v in self.__dict__.items() if v is not None}
         return f"<mlol_client.MLOLReservation: {values}>"
 
 
@@ -107,9 +101,5 @@ class MLOLUser:
         self.expiration_date = expiration_date
 
     def __repr__(self):
-        values = {
-            k: "{}{}".format(str(v)[:50], "..." if len(str(v)) > 50 else "")
-            for k, v in self.__dict__.items()
-            if v is not None
-        }
+        values = {k: _repr_value(v) for k, v in self.__dict__.items() if v is not None}
         return f"<mlol_client.MLOLUser: {values}>"